@@ -0,0 +1,223 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import supply_chain_optimizer as sco
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+COMPARISON_LAYOUTS = sco.DEFAULT_LAYOUTS
+
+def region_centers():
+    """Coordenadas dos 55 pontos reais de `load_delivery_points`, usadas como centros das regiões"""
+    optimizer = sco.WarehouseOptimizer()
+    optimizer.load_delivery_points()
+    return optimizer.delivery_points.lat, optimizer.delivery_points.lon
+
+def generate_synthetic_deliveries(num_points, seed=0, spread_km=1.5, background_fraction=0.1):
+    """Gerar entregas sintéticas agrupadas em torno das regiões de Brasília.
+
+    A maior parte dos pontos segue uma normal de desvio `spread_km` ao redor de um dos
+    pontos reais; uma fração `background_fraction` fica espalhada pelo retângulo do DF.
+    """
+    rng = np.random.default_rng(seed)
+    center_lat, center_lon = region_centers()
+    num_background = int(num_points * background_fraction)
+    num_clustered = num_points - num_background
+
+    chosen = rng.integers(0, len(center_lat), num_clustered)
+    spread_deg = spread_km / 111.32
+    lat = center_lat[chosen] + rng.normal(0, spread_deg, num_clustered)
+    lon = center_lon[chosen] + rng.normal(0, spread_deg / np.cos(np.radians(center_lat[chosen])), num_clustered)
+    lat = np.concatenate((lat, rng.uniform(-16.05, -15.50, num_background)))
+    lon = np.concatenate((lon, rng.uniform(-48.30, -47.30, num_background)))
+
+    return sco.PointSet(
+        np.arange(num_points),
+        np.full(num_points, "", dtype=object),
+        lat,
+        lon,
+        sco.DeliveryPoint
+    )
+
+def peak_rss_mb():
+    """Pico de memória residente do processo em MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def _timed(results, size, stage, func, repeat=1):
+    """Executar `func` `repeat` vezes e registrar o melhor tempo (e a mediana) da etapa.
+
+    O melhor tempo é o menos afetado por ruído do sistema; os contadores são os da última
+    execução.
+    """
+    times = []
+    for _ in range(max(1, repeat)):
+        before = sco.instrumentation.snapshot()
+        started = time.perf_counter()
+        value = func()
+        times.append(time.perf_counter() - started)
+    elapsed = min(times)
+    results.append({
+        'size': size,
+        'stage': stage,
+        'seconds': elapsed,
+        'median_seconds': float(np.median(times)),
+        'repeat': len(times),
+        'throughput': size / elapsed if elapsed > 0 else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'counters': sco.instrumentation.since(before)['counters'],
+    })
+    return value
+
+def run_size(size, metric="ellipsoidal", num_warehouses=5, report_max_points=20_000, seed=0, repeat=5):
+    """Cronometrar cada etapa do otimizador para um conjunto sintético de `size` pontos.
+
+    Cada etapa roda `repeat` vezes; o relatório é gerado sem cache, para que as repetições
+    meçam sempre a renderização completa.
+    """
+    sco.set_quiet(True)
+    # O otimizador importa as bibliotecas pesadas só quando precisa; importá-las aqui
+    # mantém o custo de importação fora das etapas cronometradas
+    import sklearn.cluster, sklearn.neighbors, matplotlib.figure, folium  # noqa: F401
+    results = []
+    deliveries = generate_synthetic_deliveries(size, seed)
+    optimizer = sco.WarehouseOptimizer(metric)
+    optimizer.delivery_points = deliveries
+
+    _timed(results, size, "place_warehouses_kmeans",
+           lambda: optimizer.place_warehouses_kmeans(num_warehouses), repeat)
+    _timed(results, size, "assign_deliveries_to_warehouses",
+           optimizer.assign_deliveries_to_warehouses, repeat)
+    _timed(results, size, "calculate_total_distance",
+           optimizer.calculate_total_distance, repeat)
+
+    if size <= report_max_points:
+        all_metrics = sco.evaluate_layouts(COMPARISON_LAYOUTS, workers=1, optimizer=optimizer)
+        with tempfile.TemporaryDirectory() as workdir:
+            previous = os.getcwd()
+            os.chdir(workdir)
+            try:
+                _timed(results, size, "create_expanded_comparison",
+                       lambda: sco.create_expanded_comparison(all_metrics, cache_dir=None), repeat)
+            finally:
+                os.chdir(previous)
+
+    return results
+
+def _run_size_worker(args):
+    return run_size(*args)
+
+def run_benchmarks(sizes, metric="ellipsoidal", num_warehouses=5, report_max_points=20_000, seed=0, repeat=5):
+    """Executar cada tamanho num processo novo, para que o pico de RSS seja medido por tamanho"""
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for size in sizes:
+        print(f"Executando benchmark com {size} pontos...")
+        with context.Pool(1) as pool:
+            size_results = pool.apply(_run_size_worker,
+                                      ((size, metric, num_warehouses, report_max_points, seed, repeat),))
+        for entry in size_results:
+            print(f"  {entry['stage']}: {entry['seconds']:.4f} s "
+                  f"({entry['throughput'] or 0:,.0f} pontos/s, pico {entry['peak_rss_mb']:.0f} MB)")
+        results.extend(size_results)
+    return results
+
+def compare_with_baseline(results, baseline, tolerance=0.25, min_seconds=0.05):
+    """Retornar as etapas cujo tempo piorou mais que `tolerance` em relação à linha de base.
+
+    Compara os melhores tempos de cada etapa. Etapas que levam menos de `min_seconds` nas
+    duas medições são ignoradas, pois nesse intervalo a variação é dominada por ruído.
+    """
+    reference = {(entry['size'], entry['stage']): entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        previous = reference.get((entry['size'], entry['stage']))
+        if previous is None or previous['seconds'] <= 0:
+            continue
+        if max(entry['seconds'], previous['seconds']) < min_seconds:
+            continue
+        ratio = entry['seconds'] / previous['seconds']
+        if ratio > 1 + tolerance:
+            regressions.append({
+                'size': entry['size'],
+                'stage': entry['stage'],
+                'seconds': entry['seconds'],
+                'baseline_seconds': previous['seconds'],
+                'ratio': ratio,
+            })
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark das etapas do otimizador de Korreios")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES,
+                        help="Quantidades de pontos sintéticos (ex.: 1000 10000 10000000)")
+    parser.add_argument("--metric", choices=sco.DISTANCE_METRICS, default="ellipsoidal")
+    parser.add_argument("--num-warehouses", type=int, default=5)
+    parser.add_argument("--report-max-points", type=int, default=20_000,
+                        help="Maior tamanho em que o relatório HTML é cronometrado")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default="benchmark_baseline.json",
+                        help="Arquivo de linha de base para detectar regressões")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Gravar os resultados como nova linha de base")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Piora relativa de tempo tolerada antes de acusar regressão")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Execuções de cada etapa; vale o melhor tempo")
+    parser.add_argument("--min-seconds", type=float, default=0.05,
+                        help="Etapas mais rápidas que isso nas duas medições não acusam regressão")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, args.metric, args.num_warehouses, args.report_max_points, args.seed,
+                             args.repeat)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'metric': args.metric,
+            'num_warehouses': args.num_warehouses,
+            'seed': args.seed,
+            'repeat': args.repeat,
+            'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        'results': results,
+    }
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Resultados salvos em {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Linha de base salva em {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Nenhuma linha de base em {args.baseline}; use --save-baseline para criar uma.")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare_with_baseline(results, baseline, args.tolerance, args.min_seconds)
+    for regression in regressions:
+        print(f"Regressão: {regression['stage']} com {regression['size']} pontos levou "
+              f"{regression['seconds']:.4f} s (linha de base {regression['baseline_seconds']:.4f} s, "
+              f"{regression['ratio']:.2f}x)")
+    if regressions:
+        return 1
+    print("Nenhuma regressão em relação à linha de base.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+import supply_chain_optimizer as sco
+
+@pytest.mark.parametrize("method", sco.CAPACITY_METHODS)
+def test_capacitated_overflow_counts_each_excess_point_once(method):
+    candidate_idx = np.array([[0], [0]])
+    candidate_dist = np.array([[5.0], [1.0]])
+    capacities = [1]
+    
+    assignment, _, overflow = sco.capacitated_assignment(candidate_idx, candidate_dist, capacities, method)
+    
+    loads = np.bincount(assignment, minlength=len(capacities))
+    assert overflow.sum() == sco.load_balance_metrics(loads, capacities)['overflow'] == 1
+
+def test_site_matrix_follows_replaced_delivery_points():
+    optimizer = sco.WarehouseOptimizer()
+    optimizer.load_delivery_points()
+    optimizer.place_warehouses_custom([9, 10, 4, 6, 1])
+    optimizer.assign_deliveries_to_warehouses()
+    full = optimizer.get_site_distance_matrix()
+    
+    optimizer.remove_delivery_points([0])
+    optimizer.add_delivery_points([{"name": "Nova", "lat": -15.60, "lon": -47.70}])
+    
+    assert optimizer.get_site_distance_matrix().shape == full.shape
+    assert not np.array_equal(optimizer.get_site_distance_matrix(), full)
+    
+def test_site_matrix_is_shared_by_shallow_copies():
+    optimizer = sco.WarehouseOptimizer()
+    optimizer.load_delivery_points()
+    matrix = optimizer.get_site_distance_matrix()
+    
+    optimizer.delivery_points = optimizer.delivery_points.shallow_copy()
+    
+    assert optimizer.get_site_distance_matrix() is matrix
+
+def _capacitated_optimizer(capacity):
+    optimizer = sco.WarehouseOptimizer()
+    optimizer.load_delivery_points()
+    optimizer.place_warehouses_custom([9, 10, 4, 6, 1])
+    optimizer.assign_deliveries_capacitated(capacity)
+    return optimizer
+    
+@pytest.mark.parametrize("operation", [
+    lambda optimizer: optimizer.open_warehouse(3),
+    lambda optimizer: optimizer.close_warehouse(0),
+    lambda optimizer: optimizer.add_delivery_points([{"name": "Nova", "lat": -15.60, "lon": -47.70}]),
+    lambda optimizer: optimizer.remove_delivery_points([0]),
+])
+def test_incremental_operations_refuse_capacitated_assignment(operation):
+    optimizer = _capacitated_optimizer(15)
+    before = optimizer.get_optimization_metrics()
+    
+    assert operation(optimizer) is None
+    
+    after = optimizer.get_optimization_metrics()
+    assert after['total_distance'] == before['total_distance']
+    assert after['deliveries_per_warehouse'].tolist() == before['deliveries_per_warehouse'].tolist()
+    
+def test_uncapacitated_reassignment_clears_capacities():
+    optimizer = _capacitated_optimizer(12)
+    optimizer.place_warehouses_pmedian(4)
+    optimizer.assign_deliveries_to_warehouses()
+    
+    metrics = optimizer.get_optimization_metrics()
+    
+    assert optimizer.capacities is None and optimizer.overflow is None
+    assert metrics['overflow'] == 0
+    assert sum(metrics['deliveries_per_warehouse']) == metrics['total_demand']
+    
+def test_capacitated_loads_are_demand():
+    optimizer = _capacitated_optimizer(11)
+    
+    metrics = optimizer.get_optimization_metrics()
+    
+    assert sum(metrics['deliveries_per_warehouse']) == metrics['total_demand']
+    assert metrics['overflow'] == int(optimizer.overflow.sum())
+
+def test_capacity_rejects_aggregated_points():
+    assert sco.run_warehouse_optimization("custom", [9, 10, 4, 6, 1], capacity=11, aggregate=True) is None
+    
+    optimizer = sco.WarehouseOptimizer()
+    optimizer.load_delivery_points()
+    optimizer.aggregate_delivery_points(5.0)
+    optimizer.place_warehouses_custom([9, 10, 4, 6, 1])
+    
+    assert optimizer.assign_deliveries_capacitated(11) is None
+    assert optimizer.capacities is None